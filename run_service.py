@@ -7,49 +7,130 @@ import os
 import sys
 import time
 import logging
+import logging.handlers
+import queue
 import asyncio
 import signal
+import contextlib
+import threading
 import importlib.util
-from datetime import datetime
 from pathlib import Path
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # Import the main scraper module (handles hyphenated filename)
+# SourceFileLoader already caches bytecode in __pycache__, so only the module
+# body runs here; registering it in sys.modules avoids executing it twice.
 script_dir = os.path.dirname(os.path.abspath(__file__))
-spec = importlib.util.spec_from_file_location("telegram_scraper", os.path.join(script_dir, "telegram-scraper.py"))
-telegram_scraper = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(telegram_scraper)
+telegram_scraper = sys.modules.get("telegram_scraper")
+if telegram_scraper is None:
+    spec = importlib.util.spec_from_file_location("telegram_scraper", os.path.join(script_dir, "telegram-scraper.py"))
+    telegram_scraper = importlib.util.module_from_spec(spec)
+    sys.modules["telegram_scraper"] = telegram_scraper
+    spec.loader.exec_module(telegram_scraper)
 
 OptimizedTelegramScraper = telegram_scraper.OptimizedTelegramScraper
 
-# Configure logging
-log_dir = Path("logs")
-log_dir.mkdir(exist_ok=True)
+class BufferedFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """Rotating file handler that batches writes in a large buffer and flushes periodically"""
+    
+    def __init__(self, filename, buffer_size=1 << 20, flush_interval=2.0, **kwargs):
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        super().__init__(filename, **kwargs)
+        self._stop_flusher = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name='log-flusher', daemon=True)
+        self._flusher.start()
+    
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=self.buffer_size,
+                    encoding=self.encoding, errors=self.errors)
+    
+    def flush(self):
+        # StreamHandler.emit flushes after every record; defer to the flusher thread
+        pass
+    
+    def flush_buffer(self):
+        """Write buffered records to disk"""
+        super().flush()
+    
+    def _flush_loop(self):
+        while not self._stop_flusher.wait(self.flush_interval):
+            self.flush_buffer()
+    
+    def close(self):
+        self._stop_flusher.set()
+        self.flush_buffer()
+        super().close()
+
+log_listener = None
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_dir / f'telegram_scraper_{datetime.now():%Y%m%d}.log'),
+def setup_logging():
+    """Configure service logging, replacing any previous setup"""
+    global log_listener
+    
+    # Stop the previous listener and close its handlers so repeated setup
+    # does not leak threads or open log files
+    if log_listener is not None:
+        log_listener.stop()
+        for handler in log_listener.handlers:
+            handler.close()
+    
+    log_dir = Path("logs")
+    log_dir.mkdir(exist_ok=True)
+    
+    # Records are queued on the event loop thread and written by a background
+    # listener thread, so disk writes never block the loop
+    log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    log_handlers = [
+        BufferedFileHandler(log_dir / 'telegram_scraper.log', when='midnight', backupCount=14, encoding='utf-8'),
         logging.StreamHandler()
     ]
-)
+    for handler in log_handlers:
+        handler.setFormatter(log_formatter)
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+    log_listener.start()
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        handlers=[queue_handler],
+        force=True  # Replace existing root handlers instead of stacking duplicates
+    )
 
 logger = logging.getLogger('TelegramScraperService')
 
 class TelegramScraperService:
     def __init__(self):
         self.scraper = OptimizedTelegramScraper()
+        # Commit rows and save offsets once per cycle in flush_state()
+        self.scraper.defer_commits = True
+        self._flush_future = None
         self.running = True
         self.shutdown_requested = False
-        self.setup_signal_handlers()
+        self.scrape_semaphore = asyncio.Semaphore(max(1, int(os.environ.get('SCRAPE_CONCURRENCY', 8))))
+        self.prefetch_semaphore = asyncio.Semaphore(2)  # Entity lookups allowed ahead of a free slot
+        self._stop_event = None  # Created in run_service once the loop exists
+        self._main_task = None
+        self._cycle_running = False  # Shutdown only cancels while scrapes are in flight
+        self.wait_time = max(1, int(os.environ.get('SCRAPE_INTERVAL', 300)))  # Default 5 minutes
+        # Optional upper bound on a single channel scrape (unset or <= 0 = no limit)
+        scrape_timeout = float(os.environ.get('SCRAPE_TIMEOUT') or 0)
+        self.scrape_timeout = scrape_timeout if scrape_timeout > 0 else None
         
-    def setup_signal_handlers(self):
-        """Setup graceful shutdown handlers"""
+    def setup_signal_handlers(self, loop):
+        """Setup graceful shutdown handlers on the running event loop"""
         for sig in [signal.SIGTERM, signal.SIGINT]:
-            signal.signal(sig, self.shutdown_handler)
+            loop.add_signal_handler(sig, self._on_shutdown, sig)
     
-    def shutdown_handler(self, signum, frame):
-        """Handle shutdown signals gracefully"""
+    def _on_shutdown(self, signum):
+        """Handle shutdown signals gracefully (runs on the event loop)"""
         if self.shutdown_requested:
             logger.warning("Force shutdown requested, exiting immediately...")
             sys.exit(0)
@@ -59,13 +140,60 @@ class TelegramScraperService:
         self.running = False
         self.scraper.continuous_scraping_active = False
         
+        # Cancel in-flight scrapes during a cycle; otherwise wake the idle wait
+        if self._cycle_running:
+            self._main_task.cancel()
+        else:
+            self._stop_event.set()
+        
+    async def _scrape_one(self, channel, offset_id):
+        """Scrape a single channel, holding a concurrency slot"""
+        # Resolve the entity while waiting for a slot so the lookup overlaps
+        # with scrapes in flight; the prefetch slot is held until a scrape
+        # slot frees up, so only a couple of lookups run ahead at a time
+        async with self.prefetch_semaphore:
+            try:
+                entity = await self.scraper.resolve_entity(channel)
+            except Exception as e:
+                logger.error(f"Error resolving channel {channel}: {e}")
+                return
+            await self.scrape_semaphore.acquire()
+        
+        try:
+            logger.info(f"Scraping channel: {channel}")
+            await asyncio.wait_for(
+                self.scraper.scrape_channel(channel, offset_id, entity=entity),
+                timeout=self.scrape_timeout
+            )
+        except asyncio.CancelledError:
+            logger.info(f"Scrape of channel {channel} cancelled")
+            raise
+        except asyncio.TimeoutError:
+            logger.error(f"Scraping channel {channel} timed out after {self.scrape_timeout} seconds")
+        except Exception as e:
+            logger.error(f"Error scraping channel {channel}: {e}")
+        finally:
+            self.scrape_semaphore.release()
+        
+    def _close_databases(self):
+        """Commit pending rows and offsets, then close the scraper databases"""
+        try:
+            self.scraper.flush_state()
+        finally:
+            self.scraper.close_db_connections()
+        
     async def run_service(self):
         """Main service loop"""
         logger.info("Starting Telegram Scraper Service")
+        self._stop_event = asyncio.Event()
+        self._main_task = asyncio.current_task()
+        self.setup_signal_handlers(asyncio.get_running_loop())
         
         try:
             # Initialize the client
             await self.scraper.initialize_client()
+            if not self.scraper.client.is_connected():
+                raise RuntimeError("Telegram client failed to connect")
             logger.info("Telegram client initialized successfully")
             
             # Check if we have channels configured
@@ -73,37 +201,48 @@ class TelegramScraperService:
                 logger.error("No channels configured! Add channels before running as service.")
                 return
             
-            # Run continuous scraping
+            # Run continuous scraping, reusing the single client connection
             while self.running and not self.shutdown_requested:
                 try:
-                    logger.info(f"Starting scrape cycle for {len(self.scraper.state['channels'])} channels")
+                    if not self.scraper.client.is_connected():
+                        logger.warning("Telegram client disconnected, reconnecting...")
+                        await self.scraper.client.connect()
+                    
+                    channels = self.scraper.state['channels']
+                    logger.info(f"Starting scrape cycle for {len(channels)} channels")
                     
-                    for channel in self.scraper.state['channels']:
-                        if not self.running or self.shutdown_requested:
-                            logger.info("Shutdown requested, stopping channel processing...")
-                            break
-                            
-                        logger.info(f"Scraping channel: {channel}")
-                        try:
-                            await self.scraper.scrape_channel(
-                                channel, 
-                                self.scraper.state['channels'][channel]
-                            )
-                        except Exception as e:
-                            logger.error(f"Error scraping channel {channel}: {e}")
-                            # Continue with other channels
+                    # Scrape channels concurrently, bounded by SCRAPE_CONCURRENCY;
+                    # shutdown cancels the whole group via the main task. Iterating
+                    # the live view is safe: task creation never awaits, so nothing
+                    # can add or remove channels mid-iteration
+                    self._cycle_running = True
+                    try:
+                        async with asyncio.TaskGroup() as tg:
+                            for channel, offset_id in channels.items():
+                                tg.create_task(self._scrape_one(channel, offset_id))
+                    finally:
+                        self._cycle_running = False
+                    
+                    # Commit DB and state once per cycle, off the event loop; shielded
+                    # so a shutdown cannot abandon the flush while it is running
+                    try:
+                        self._flush_future = asyncio.get_running_loop().run_in_executor(
+                            None, self.scraper.flush_state
+                        )
+                        await asyncio.shield(self._flush_future)
+                    except Exception as e:
+                        logger.error(f"Error flushing scraper state: {e}")
                     
                     if self.running and not self.shutdown_requested:
                         # Wait before next cycle (configurable) - interruptible sleep
-                        wait_time = int(os.environ.get('SCRAPE_INTERVAL', 300))  # Default 5 minutes
+                        wait_time = self.wait_time
                         logger.info(f"Waiting {wait_time} seconds before next cycle...")
                         
-                        # Sleep in small chunks so we can respond to shutdown signals
-                        for _ in range(wait_time):
-                            if not self.running or self.shutdown_requested:
-                                logger.info("Shutdown requested during wait, exiting...")
-                                break
-                            await asyncio.sleep(1)
+                        # Single wait that returns early when shutdown sets the stop event
+                        with contextlib.suppress(asyncio.TimeoutError):
+                            await asyncio.wait_for(self._stop_event.wait(), timeout=wait_time)
+                        if self._stop_event.is_set():
+                            logger.info("Shutdown requested during wait, exiting...")
                         
                 except Exception as e:
                     logger.error(f"Error in scraping cycle: {e}")
@@ -111,13 +250,32 @@ class TelegramScraperService:
                         # Wait before retry
                         await asyncio.sleep(60)
                         
+        except asyncio.CancelledError:
+            # The cancel came from _on_shutdown; clear it so cleanup can await
+            self._main_task.uncancel()
+            logger.info("Scraping cancelled by shutdown request")
         except Exception as e:
             logger.error(f"Fatal error in service: {e}")
         finally:
             logger.info("Cleaning up...")
-            self.scraper.close_db_connections()
-            if self.scraper.client:
-                await self.scraper.client.disconnect()
+            # Let an in-flight flush finish before the databases are closed
+            if self._flush_future is not None:
+                await asyncio.wait({self._flush_future})
+            
+            # Commit and close SQLite (off the loop, may block on fsync) and
+            # disconnect the client concurrently; they touch independent resources
+            loop = asyncio.get_running_loop()
+            results = await asyncio.gather(
+                loop.run_in_executor(None, self._close_databases),
+                asyncio.wait_for(self.scraper.client.disconnect(), timeout=5)
+                if self.scraper.client else asyncio.sleep(0),
+                return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, asyncio.TimeoutError):
+                    logger.warning("Timed out disconnecting Telegram client")
+                elif isinstance(result, Exception):
+                    logger.error(f"Error during cleanup: {result}")
             logger.info("Service stopped")
 
 async def main():
@@ -125,10 +283,19 @@ async def main():
     await service.run_service()
 
 if __name__ == '__main__':
+    setup_logging()
     try:
-        asyncio.run(main())
+        if uvloop is not None:
+            # Optional faster event loop when uvloop is installed
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                runner.run(main())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Service interrupted by user")
     except Exception as e:
         logger.error(f"Service crashed: {e}")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+    finally:
+        # Flush any queued records before the process exits
+        log_listener.stop()
\ No newline at end of file
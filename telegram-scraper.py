@@ -53,6 +53,7 @@ class OptimizedTelegramScraper:
         self.batch_size = 100
         self.state_save_interval = 50
         self.db_connections = {}
+        self.defer_commits = False
         
     def load_state(self) -> Dict[str, Any]:
         if os.path.exists(self.STATE_FILE):
@@ -88,6 +89,16 @@ class OptimizedTelegramScraper:
         
         return self.db_connections[channel]
 
+    def save_progress(self):
+        # With deferred commits, flush_state() saves offsets after committing them
+        if not self.defer_commits:
+            self.save_state()
+
+    def flush_state(self):
+        for conn in self.db_connections.values():
+            conn.commit()
+        self.save_state()
+
     def close_db_connections(self):
         for conn in self.db_connections.values():
             conn.close()
@@ -106,7 +117,8 @@ class OptimizedTelegramScraper:
                            (message_id, date, sender_id, first_name, last_name, username, 
                             message, media_type, media_path, reply_to)
                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', data)
-        conn.commit()
+        if not self.defer_commits:
+            conn.commit()
 
     async def download_media_with_semaphore(self, semaphore: asyncio.Semaphore, 
                                           channel: str, message) -> Optional[str]:
@@ -165,14 +177,23 @@ class OptimizedTelegramScraper:
         conn = self.get_db_connection(channel)
         conn.execute('UPDATE messages SET media_path = ? WHERE message_id = ?', 
                     (media_path, message_id))
-        conn.commit()
+        if not self.defer_commits:
+            conn.commit()
+
+    async def resolve_entity(self, channel: str):
+        if channel.startswith('-'):
+            return await self.client.get_entity(PeerChannel(int(channel)))
+        return await self.client.get_entity(channel)
+
+    async def scrape_channel(self, channel: str, offset_id: int, entity=None):
+        message_batch = []
+        media_download_tasks = []
+        last_message_id = offset_id
+        last_inserted_id = offset_id
 
-    async def scrape_channel(self, channel: str, offset_id: int):
         try:
-            if channel.startswith('-'):
-                entity = await self.client.get_entity(PeerChannel(int(channel)))
-            else:
-                entity = await self.client.get_entity(channel)
+            if entity is None:
+                entity = await self.resolve_entity(channel)
 
             result = await self.client.get_messages(entity, offset_id=offset_id, reverse=True, limit=0)
             total_messages = result.total
@@ -183,10 +204,7 @@ class OptimizedTelegramScraper:
 
             print(f"Found {total_messages} messages in channel {channel}")
 
-            message_batch = []
-            media_download_tasks = []
             processed_messages = 0
-            last_message_id = offset_id
 
             download_semaphore = asyncio.Semaphore(self.max_concurrent_downloads)
 
@@ -221,10 +239,12 @@ class OptimizedTelegramScraper:
                     if len(message_batch) >= self.batch_size:
                         self.batch_insert_messages(channel, message_batch)
                         message_batch.clear()
+                        last_inserted_id = last_message_id
 
+                    # Only persist offsets whose messages are already in the database
                     if processed_messages % self.state_save_interval == 0:
-                        self.state['channels'][channel] = last_message_id
-                        self.save_state()
+                        self.state['channels'][channel] = last_inserted_id
+                        self.save_progress()
 
                     progress = (processed_messages / total_messages) * 100
                     sys.stdout.write(f"\rScraping {channel}: {progress:.1f}% ({processed_messages}/{total_messages})")
@@ -235,6 +255,7 @@ class OptimizedTelegramScraper:
 
             if message_batch:
                 self.batch_insert_messages(channel, message_batch)
+                message_batch.clear()
 
             if media_download_tasks:
                 print(f"\nWaiting for {len(media_download_tasks)} media downloads to complete...")
@@ -247,10 +268,20 @@ class OptimizedTelegramScraper:
                         print(f"Error in media download for message {message_id}: {e}")
 
             self.state['channels'][channel] = last_message_id
-            self.save_state()
+            self.save_progress()
             
             print(f"\nCompleted scraping channel {channel}")
 
+        except asyncio.CancelledError:
+            # Keep what was fetched so a resumed scrape does not skip messages;
+            # unfinished media downloads are left for rescrape_media
+            self.batch_insert_messages(channel, message_batch)
+            for _, task in media_download_tasks:
+                task.cancel()
+            self.state['channels'][channel] = last_message_id
+            self.save_progress()
+            print(f"\nScraping channel {channel} cancelled at message {last_message_id}")
+            raise
         except Exception as e:
             print(f"Error with channel {channel}: {e}")
 